@@ -1,51 +1,197 @@
 import os
 from flask import Flask, abort, request, jsonify, g, url_for, redirect
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, event
+from sqlalchemy.engine import Engine
+from functools import wraps
 from flask_httpauth import HTTPBasicAuth
-from flask import make_response
+from flask import make_response, Response, Request, stream_with_context, has_request_context
+from flask.json import JSONEncoder
 from itsdangerous import (TimedJSONWebSignatureSerializer
                           as Serializer, BadSignature, SignatureExpired)
-from flask_bcrypt import Bcrypt
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 import re
 from flask_marshmallow import Marshmallow
 import config
+from notifications import NotificationDispatcher
+from reaper import S3Reaper
+from background import PerProcess, after_fork
+from cache import LocalCache, RedisCache, DictCache, NullCache
+from singleflight import SingleFlight
+from metrics import BufferedStatsClient, UDPSink, MemorySink, NullSink
+from logs import setup_logging
+from passwords import HashPool, HashPoolBusy
 from flask_migrate import Migrate
 import sys
 from werkzeug.utils import secure_filename
 import boto3
+import botocore
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+import io
 import time
-import statsd
-import logging
 import json
+import atexit
+import hashlib
+import hmac
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+class InMemoryUploadRequest(Request):
+    # uploads are capped by MAX_CONTENT_LENGTH, so keep them in memory and
+    # hand the stream straight to S3 instead of spooling to a temp file
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return io.BytesIO()
+
+
+# timestamps keep the format they had when they were stored as strings
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class TimestampJSONEncoder(JSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.strftime(TIMESTAMP_FORMAT)
+        return JSONEncoder.default(self, o)
+
 
 # initialization
-c = statsd.StatsClient('localhost', 8125)
+if config.METRICS_BACKEND == 'memory':
+    metrics_sink = MemorySink()
+elif config.METRICS_BACKEND == 'null':
+    metrics_sink = NullSink()
+else:
+    metrics_sink = UDPSink(config.STATSD_HOST, config.STATSD_PORT)
+c = BufferedStatsClient(metrics_sink, flush_interval=config.METRICS_FLUSH_INTERVAL)
+atexit.register(c.flush)
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
+app.json_encoder = TimestampJSONEncoder
 app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_COMMIT_ON_TEARDOWN'] = config.SQLALCHEMY_COMMIT_ON_TEARDOWN
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = config.SQLALCHEMY_TRACK_MODIFICATIONS
+app.config['SQLALCHEMY_BINDS'] = config.SQLALCHEMY_BINDS
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config.SQLALCHEMY_ENGINE_OPTIONS
 
-UPLOAD_FOLDER = '/home/ubuntu'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 bucket = config.s3_bucketname
+s3_transfer_config = TransferConfig(multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+                                    multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE,
+                                    max_concurrency=config.S3_MAX_CONCURRENCY)
+
+# One S3 client per process, shared by every request thread. boto3 clients are
+# thread safe but their connection pools must not be shared across a fork.
+
+
+def s3_call_start(context, **kwargs):
+    context['s3_call_start'] = time.time()
+
+
+def s3_call_done(context, model, **kwargs):
+    if 's3_call_start' in context:
+        dur = (time.time() - context['s3_call_start']) * 1000
+        c.timing("s3_" + model.name + "_time", dur)
+
+
+def make_s3_client():
+    client = boto3.session.Session().client('s3', config=BotoConfig(
+        max_pool_connections=config.S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True))
+    client.meta.events.register('before-call.s3', s3_call_start)
+    client.meta.events.register('after-call.s3', s3_call_done)
+    return client
+
+
+s3_client = PerProcess(make_s3_client)
+get_s3_client = s3_client.get
+
+upload_pool = PerProcess(lambda: ThreadPoolExecutor(max_workers=config.S3_UPLOAD_WORKERS,
+                                                    thread_name_prefix='s3-upload'))
+get_upload_pool = upload_pool.get
+
+
+def upload_to_s3(file, s3_object_name):
+    start_s3 = time.time()
+
+    get_s3_client().upload_fileobj(file.stream, bucket, s3_object_name,
+                                   ExtraArgs={'ContentType': file.mimetype},
+                                   Config=s3_transfer_config)
+
+    dur_s3 = (time.time() - start_s3) * 1000
+    c.timing("s3_upload_image_time", dur_s3)
+
+
+reaper = S3Reaper(get_s3_client, bucket, c,
+                  queue_size=config.S3_REAPER_QUEUE_SIZE,
+                  max_retries=config.S3_REAPER_MAX_RETRIES)
+atexit.register(reaper.stop)
 
 # print(os.path.dirname(os.path.realpath(__file__)))
 # print(os.getcwd())
 
+class RoutingSession(SignallingSession):
+    # routes marked with @use_replica read from the replica bind, anything
+    # that flushes still goes to the primary
+    def get_bind(self, mapper=None, clause=None):
+        if (not self._flushing and has_request_context() and g.get('use_replica')
+                and 'replica' in (self.app.config['SQLALCHEMY_BINDS'] or {})):
+            return db.get_engine(self.app, bind='replica')
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        # SQLite has no connection pool to size, create_engine rejects the options
+        if sa_url.drivername.startswith('sqlite'):
+            engine_opts = {k: v for k, v in engine_opts.items()
+                           if k not in ('pool_size', 'max_overflow')}
+        return SQLAlchemy.create_engine(self, sa_url, engine_opts)
+
+
 # extensions
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 ma = Marshmallow(app)
 auth = HTTPBasicAuth()
+hash_pool = HashPool(config.BCRYPT_LOG_ROUNDS, workers=config.HASH_WORKERS,
+                     queue_size=config.HASH_QUEUE_SIZE, timeout=config.HASH_TIMEOUT)
+atexit.register(hash_pool.shutdown)
+
+log_handler = setup_logging(config.LOG_FILE, config.LOG_INFO_SAMPLE_RATE)
+atexit.register(log_handler.stop)
+
+sns_client = PerProcess(lambda: boto3.session.Session().client('sns', region_name='us-east-1'))
+notifier = NotificationDispatcher(sns_client.get, config.SNS_TOPIC_ARN, c,
+                                  queue_size=config.SNS_QUEUE_SIZE,
+                                  workers=config.SNS_WORKERS,
+                                  max_retries=config.SNS_MAX_RETRIES)
+atexit.register(notifier.stop)
 
-logging.basicConfig(filename='/home/ubuntu/webapp/app/csye6225.log', level=logging.INFO,
-                    format=f'%(asctime)s %(levelname)s %(name)s %(threadName)s : %(message)s')
 
-sns_client = boto3.client('sns', region_name='us-east-1')
+if config.BOOK_CACHE_BACKEND == 'redis':
+    book_cache = RedisCache(c, 'book', config.REDIS_URL, ttl=config.BOOK_CACHE_TTL)
+elif config.BOOK_CACHE_BACKEND == 'dict':
+    book_cache = DictCache(c, 'book')
+elif config.BOOK_CACHE_BACKEND == 'null':
+    book_cache = NullCache()
+else:
+    book_cache = LocalCache(c, 'book', max_size=config.BOOK_CACHE_SIZE, ttl=config.BOOK_CACHE_TTL)
+
+read_flight = SingleFlight(timeout=config.COALESCE_TIMEOUT)
+
+
+@after_fork
+def dispose_engines():
+    # a forked worker must not reuse database connections opened by its parent
+    with app.app_context():
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+            db.get_engine(app, bind=bind).dispose()
 
 # SQLite Database
 class User(db.Model):
@@ -58,18 +204,32 @@ class User(db.Model):
     password_hash = db.Column(db.String(64), nullable=False)
     first_name = db.Column(db.String(64), nullable=False)
     last_name = db.Column(db.String(64), nullable=False)
-    account_created = db.Column(db.String, index=True, default=datetime.now)
-    account_updated = db.Column(db.String, default=datetime.now)
+    account_created = db.Column(db.DateTime, index=True, default=datetime.now)
+    account_updated = db.Column(db.DateTime, default=datetime.now)
 
     def hash_password(self, password):
-        self.password_hash = Bcrypt().generate_password_hash(password).decode()
+        self.password_hash = hash_pool.hash(password)
 
     def verify_password(self, password):
-        return Bcrypt().check_password_hash(self.password_hash, password)
+        return hash_pool.check(self.password_hash, password)
+
+    def needs_rehash(self):
+        return hash_pool.needs_rehash(self.password_hash)
 
     def __repr__(self):
         return '<User {}>'.format(self.username)
 
+    def password_epoch(self):
+        # changes with the password, so tokens issued before a change can be
+        # told apart without putting the hash itself in the token
+        message = self.password_hash.encode()
+        return hmac.new(app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()[:16]
+
+    def generate_auth_token(self, expiration=config.AUTH_TOKEN_EXPIRATION):
+        serial = Serializer(app.config['SECRET_KEY'], expires_in=expiration)
+        return serial.dumps({'id': self.id, 'username': self.username,
+                             'epoch': self.password_epoch()}).decode()
+
     @staticmethod
     def verify_auth_token(token):
         serial = Serializer(app.config['SECRET_KEY'])
@@ -79,7 +239,12 @@ class User(db.Model):
             return None    # valid token, but expired
         except BadSignature:
             return None    # invalid token
-        user = User.query.get(data['username'])
+        if 'id' in data and 'username' in data:
+            # the signed claims identify the user, no need to hit the database
+            user = User(id=data['id'], username=data['username'])
+            user.token_epoch = data.get('epoch')
+            return user
+        user = User.query.filter_by(username=data.get('username')).first()
         return user
 
 class Book(db.Model):
@@ -91,14 +256,30 @@ class Book(db.Model):
     author = db.Column(db.String(256), nullable=False)
     isbn = db.Column(db.String(64), nullable=False)
     published_date = db.Column(db.String(256), nullable=False)
-    book_created = db.Column(db.String, default=datetime.now)
-    user_id = db.Column(db.String(64))
+    book_created = db.Column(db.DateTime, default=datetime.now)
+    book_updated = db.Column(db.DateTime, default=datetime.now)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'))
+    images = db.relationship('Image', backref='book', lazy='select',
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+    # composite indexes back the GET /books filters and sorts, the id column
+    # keeps keyset pagination on the same index
+    __table_args__ = (
+        db.Index('ix_books_isbn_id', 'isbn', 'id'),
+        db.Index('ix_books_author_id', 'author', 'id'),
+        db.Index('ix_books_user_id_id', 'user_id', 'id'),
+        db.Index('ix_books_title_id', 'title', 'id'),
+        db.Index('ix_books_book_created_id', 'book_created', 'id'),
+    )
 
     def __repr__(self):
         return '<Book {}>'.format(self.title)
 
 
 class BookSchema(ma.Schema):
+    book_created = ma.DateTime(format=TIMESTAMP_FORMAT)
+
     class Meta:
         fields = ("id", "title", "author", "isbn",
                   "published_date", "book_created", "user_id")
@@ -113,15 +294,18 @@ class Image(db.Model):
 
     file_id = db.Column('file_id', db.String(length=36), primary_key=True)
     file_name = db.Column(db.String(256), nullable=False)
-    created_date = db.Column(db.String, default=datetime.now)
+    created_date = db.Column(db.DateTime, default=datetime.now)
     s3_object_name = db.Column(db.String, default='some_id')
-    user_id = db.Column(db.String(64), nullable=False)
-    book_id = db.Column(db.String(64), nullable=False)
+    user_id = db.Column(db.String(64), db.ForeignKey('users.id'), index=True, nullable=False)
+    book_id = db.Column(db.String(64), db.ForeignKey('books.id', ondelete='CASCADE'),
+                        index=True, nullable=False)
 
     def __repr__(self):
         return '<Image {}>'.format(self.file_name)
 
 class ImageSchema(ma.Schema):
+    created_date = ma.DateTime(format=TIMESTAMP_FORMAT)
+
     class Meta:
         fields = ("file_id", "file_name", "created_date", "s3_object_name",
                   "user_id", "book_id")
@@ -132,6 +316,129 @@ image_schema = ImageSchema()
 images_schema = ImageSchema(many=True)
 
 
+# Cache of verified credentials, keyed by an HMAC of username and password, so
+# bcrypt only runs on a miss. Each entry keeps the password hash it was
+# verified against, so a password change in any worker makes the entry stale.
+auth_cache = LocalCache(c, 'auth', max_size=config.AUTH_CACHE_SIZE, ttl=config.AUTH_CACHE_TTL)
+
+
+def credential_digest(username, password):
+    message = (username + ':' + password).encode()
+    return hmac.new(app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()
+
+
+# Request instrumentation: latency per endpoint and status class, plus the
+# number of SQL statements and time spent in the database for each request.
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    dur_db = (time.time() - conn.info.pop('query_start', time.time())) * 1000
+    if has_request_context() and 'request_start' in g:
+        g.db_queries += 1
+        g.db_time += dur_db
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.time()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.db_queries = 0
+    g.db_time = 0.0
+
+
+def record_request(status_code):
+    g.request_recorded = True
+    endpoint = request.endpoint or 'unknown'
+    dur = (time.time() - g.request_start) * 1000
+
+    rate = config.METRICS_SAMPLE_RATE
+    c.timing("api_" + endpoint + "_time", dur, rate)
+    c.incr("api_" + endpoint + "_" + str(status_code // 100) + "xx_count", rate=rate)
+    c.timing("db_" + endpoint + "_query_count", g.db_queries, rate)
+    c.timing("db_" + endpoint + "_query_time", g.db_time, rate)
+
+    app.logger.info('%s %s %d', request.method, request.path, status_code,
+                    extra={'status': status_code, 'latency_ms': round(dur, 3)})
+
+    if dur > config.SLOW_REQUEST_MS:
+        c.incr("api_slow_request_count")
+        app.logger.warning('Slow request %s %s took %.0fms with %d queries (%.0fms in db)',
+                           request.method, request.path, dur, g.db_queries, g.db_time)
+
+
+@app.after_request
+def stop_request_timer(response):
+    if 'request_start' in g:
+        record_request(response.status_code)
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+@app.teardown_request
+def teardown_request_timer(exc):
+    # after_request is skipped when the view raised
+    if 'request_start' in g and not g.get('request_recorded'):
+        record_request(500)
+
+
+@app.errorhandler(HashPoolBusy)
+def hash_pool_busy(e):
+    app.logger.warning('Password hashing pool saturated')
+    c.incr("hash_pool_busy_count")
+    response = make_response("Server busy, please retry", 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def use_replica(f):
+    # clients that wrote recently keep reading from the primary
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        primary_until = request.cookies.get('primary_until', '0')
+        g.use_replica = not primary_until.isdigit() or int(primary_until) < time.time()
+        return f(*args, **kwargs)
+    return decorated
+
+
+def coalesce(f):
+    # identical reads in flight in this worker share one run of the view; the
+    # key covers everything the view reads from the request
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if request.args.get('stream') is not None:
+            return f(*args, **kwargs)
+
+        key = (request.endpoint,
+               tuple(sorted(request.view_args.items())),
+               tuple(sorted(request.args.items(multi=True))),
+               request.headers.get('If-None-Match'),
+               request.headers.get('If-Modified-Since'),
+               g.get('use_replica'))
+
+        def run():
+            response = make_response(f(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers)
+
+        (body, status, headers), shared = read_flight.do(key, run)
+        if shared:
+            c.incr("api_" + request.endpoint + "_coalesced_count")
+        # every request gets its own response for the after_request hooks
+        return app.response_class(body, status=status, headers=headers)
+    return decorated
+
+
+@app.after_request
+def read_after_write(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        response.set_cookie('primary_until', str(int(time.time()) + config.REPLICA_READ_AFTER_WRITE),
+                            max_age=config.REPLICA_READ_AFTER_WRITE)
+    return response
+
+
 @auth.verify_password
 def verify_password(username, password):
     # first try to authenticate by token
@@ -139,8 +446,22 @@ def verify_password(username, password):
     if not user:
         # try to authenticate with username/password
         user = User.query.filter_by(username=username).first()
-        if not user or not user.verify_password(password):
+        if not user:
             return False
+
+        digest = credential_digest(username, password)
+        cached_hash = auth_cache.get(digest)
+        if cached_hash is None or not hmac.compare_digest(cached_hash, user.password_hash):
+            if not user.verify_password(password):
+                return False
+            if user.needs_rehash():
+                # upgrade hashes made with an older cost factor, best effort
+                try:
+                    user.hash_password(password)
+                    db.session.commit()
+                except HashPoolBusy:
+                    db.session.rollback()
+            auth_cache.set(digest, user.password_hash)
     g.user = user
     return True
 
@@ -158,8 +479,6 @@ def validate_password(password):
 
 @app.route('/v1/user', methods=['POST'])
 def new_user():
-    start = time.time()
-
     username = request.json.get('username')
     password = request.json.get('password')
     first_name = request.json.get('first_name')
@@ -202,17 +521,20 @@ def new_user():
     })
     response.status_code = 201
 
-    dur = (time.time() - start) * 1000
-    c.timing("api_create_user_time", dur)
-    c.incr(" api_create_user_count")
-
     return response
 
 
 @app.route('/v1/user/self', methods=['GET', 'PUT'])
 @auth.login_required
 def auth_api():
-    start = time.time()
+    token_auth = g.user.password_hash is None
+    if token_auth:
+        # token auth only carries the identity claims, load the full row and
+        # turn away tokens issued before the last password change
+        token_epoch = g.user.token_epoch
+        g.user = User.query.get(g.user.id)
+        if g.user is None or token_epoch != g.user.password_epoch():
+            return 'Unauthorized Access', 401
 
     if request.method == "GET":
         response = jsonify({
@@ -227,10 +549,6 @@ def auth_api():
 
         app.logger.info('Get user details by auth')
 
-        dur = (time.time() - start) * 1000
-        c.timing("api_auth_get_user_time", dur)
-        c.incr(" api_auth_get_user_count")
-
         return response
     
     if request.method == "PUT":
@@ -245,6 +563,10 @@ def auth_api():
             g.user.last_name = request.json.get('last_name')
 
         if request.json.get('password') is not None:
+            if token_auth:
+                app.logger.info('Password change with a token')
+                return "Please authenticate with your current password to change it", 401
+
             if not validate_password(request.json.get('password')):
                 app.logger.info('Weak password in update')
                 return "Please enter a strong password. Follow NIST guidelines", 400
@@ -252,10 +574,7 @@ def auth_api():
             password = request.json.get('password')
             g.user.hash_password(password)
 
-        g.user.account_updated = str(datetime.now())
-        print(request.json)
-        print(request.json.get('username'))
-        print(request.json.get('username') is not None)
+        g.user.account_updated = datetime.now()
 
         start_db = time.time()
 
@@ -276,12 +595,28 @@ def auth_api():
         })
         response.status_code = 204
 
-        dur = (time.time() - start) * 1000
-        c.timing("api_auth_user_time", dur)
-        c.incr(" api_auth_user_count")
-
         return response
 
+@app.route('/v1/user/token', methods=['POST'])
+@auth.login_required
+def get_auth_token():
+    # a token cannot be used to mint another one, that would keep it alive forever
+    if g.user.password_hash is None:
+        app.logger.info('Token requested with a token')
+        return "Please authenticate with your username and password to get a token", 401
+
+    token = g.user.generate_auth_token()
+
+    app.logger.info('Auth token issued')
+
+    response = jsonify({
+        'token': token,
+        'duration': config.AUTH_TOKEN_EXPIRATION
+    })
+    response.status_code = 201
+
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
 
@@ -289,86 +624,360 @@ def health_check():
     resp.status_code = 200
     return resp
 
+def touch_book(book_id):
+    # bump the version so cached copies of the book are revalidated
+    Book.query.filter_by(id=book_id).update({
+        Book.version: Book.version + 1,
+        Book.book_updated: datetime.now()
+    }, synchronize_session=False)
+
+
+def book_etag(book):
+    return book.id + '-' + str(book.version)
+
+
+def book_last_modified(book):
+    updated = book.book_updated or book.book_created
+    if updated is None:
+        return None
+    # timestamps are stored as naive local time
+    return updated.astimezone(timezone.utc).replace(microsecond=0, tzinfo=None)
+
+
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def cache_headers(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = config.BOOKS_CACHE_MAX_AGE
+    return response
+
+
+def images_by_book(book_ids):
+    # one IN (...) query for the whole page instead of one query per book
+    images = {}
+    if not book_ids:
+        return images
+    image_all = Image.query.filter(Image.book_id.in_(book_ids)).all()
+    for image in image_all:
+        images.setdefault(image.book_id, []).append(image_schema.dump(image))
+    return images
+
+
+def page_args():
+    limit = request.args.get('limit', config.BOOKS_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None, None
+    if limit < 1 or limit > config.BOOKS_MAX_PAGE_SIZE:
+        return None, None
+    return limit, request.args.get('after')
+
+
+# columns GET /books may be sorted by, prefix with - for descending
+BOOK_SORTS = {
+    'id': Book.id,
+    'title': Book.title,
+    'author': Book.author,
+    'book_created': Book.book_created,
+}
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value)
+
+
+def filter_books(query):
+    for name in ('isbn', 'author', 'user_id'):
+        value = request.args.get(name)
+        if value is not None:
+            query = query.filter(getattr(Book, name) == value)
+
+    created_after = request.args.get('created_after')
+    if created_after is not None:
+        query = query.filter(Book.book_created > parse_timestamp(created_after))
+
+    created_before = request.args.get('created_before')
+    if created_before is not None:
+        query = query.filter(Book.book_created < parse_timestamp(created_before))
+
+    return query
+
+
+def encode_cursor(book, sort):
+    if sort == 'id':
+        return book.id
+    value = getattr(book, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, book.id]).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    if sort == 'id':
+        return cursor, None
+    decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(decoded, list) or len(decoded) != 2 or \
+            not all(isinstance(part, str) for part in decoded):
+        raise ValueError('Invalid cursor')
+    value, book_id = decoded
+    if sort == 'book_created':
+        value = parse_timestamp(value)
+    return value, book_id
+
+
+def sort_books(query, sort, after):
+    # keyset on (sort column, id) so ties on the sort column page correctly
+    descending = sort.startswith('-')
+    column = BOOK_SORTS[sort.lstrip('-')]
+
+    if after:
+        value, book_id = decode_cursor(after, sort.lstrip('-'))
+        key = Book.id if book_id is None else db.tuple_(column, Book.id)
+        cursor = value if book_id is None else db.tuple_(value, book_id)
+        query = query.filter(key < cursor if descending else key > cursor)
+
+    order = [column] if column is Book.id else [column, Book.id]
+    if descending:
+        return query.order_by(*[col.desc() for col in order])
+    return query.order_by(*order)
+
+
+def stream_books(stream, query):
+    # rows are fetched in batches and encoded one at a time, so memory stays
+    # flat no matter how many books there are
+    books = query.order_by(Book.id).yield_per(1000)
+
+    def generate_ndjson():
+        for book in books:
+            yield json.dumps(book_schema.dump(book)) + '\n'
+
+    def generate_json():
+        yield '['
+        sep = ''
+        for book in books:
+            yield sep + json.dumps(book_schema.dump(book))
+            sep = ','
+        yield ']\n'
+
+    if stream == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+
 @app.route('/books', methods=['GET'])
+@use_replica
+@coalesce
 def get_books():
-    start = time.time()
+    try:
+        query = filter_books(Book.query)
+    except ValueError:
+        return "Please enter created_after and created_before as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS", 400
+
+    stream = request.args.get('stream')
+    if stream is not None:
+        if stream not in ('ndjson', 'json'):
+            return "Please enter stream=ndjson or stream=json", 400
+
+        app.logger.info('Streaming all books')
+        return stream_books(stream, query)
+
+    limit, after = page_args()
+    if limit is None:
+        return "Please enter a limit between 1 and " + str(config.BOOKS_MAX_PAGE_SIZE), 400
+
+    # a date range is only index backed when the pages follow book_created,
+    # so it is the default sort there
+    if 'created_after' in request.args or 'created_before' in request.args:
+        sort = request.args.get('sort', 'book_created')
+    else:
+        sort = request.args.get('sort', 'id')
+    if sort.lstrip('-') not in BOOK_SORTS:
+        return "Please sort by one of " + ', '.join(BOOK_SORTS), 400
+
+    # keyset pagination so every page costs the same
+    try:
+        query = sort_books(query, sort, after)
+    except (ValueError, TypeError):
+        return "Invalid after cursor", 400
+    books = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = encode_cursor(books[-1], sort.lstrip('-'))
+
+    versions = ','.join(book_etag(book) for book in books)
+    etag = hashlib.sha1((request.query_string.decode() + '|' + versions).encode()).hexdigest()
+    if not_modified(etag):
+        app.logger.info('Page of books not modified')
+        return cache_headers(app.response_class(status=304), etag)
+
+    result = books_schema.dump(books)
+
+    if 'images' in request.args.get('include', '').split(','):
+        images = images_by_book([book.id for book in books])
+        for r in result:
+            r['book_images'] = images.get(r['id'], [])
+
+    response = jsonify(result)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+        args = request.args.to_dict()
+        args.update(limit=limit, after=next_cursor)
+        response.headers['Link'] = '<' + url_for('get_books', **args) + '>; rel="next"'
+
+    cache_headers(response, etag)
+
+    app.logger.info('Page of books returned')
 
-    all_books = Book.query.all()
-    result = books_schema.dump(all_books)
+    return response
 
-    app.logger.info('All books returned')
 
-    dur = (time.time() - start) * 1000
-    c.timing("api_get_all_books_time", dur)
-    c.incr("api_get_all_books_count")
+# SQLite has no tsvector, the dev database indexes books with FTS5 instead.
+# Postgres gets a generated tsvector column with a GIN index from migrations.
+SQLITE_SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author, content='books')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.rowid, new.title, new.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.rowid, old.title, old.author); "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.rowid, new.title, new.author); END",
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+]
+
+
+def create_search_index():
+    if db.engine.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_INDEX:
+            db.session.execute(statement)
+        db.session.commit()
 
-    # print(result)
-    # for r in result:
-    #     print(r['id'])
-    #     book_id = print(r['id'])
-    #     image_all = Image.query.filter_by(book_id=id).all()
-    #     result = images_schema.dump(image_all)
 
-    #     if image is None:
-    #         return book_schema.jsonify(book)
+def search_query(q, limit, offset):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        vector = db.literal_column('books.search_vector')
+        tsquery = db.func.plainto_tsquery('english', q)
+        query = Book.query.filter(vector.op('@@')(tsquery)) \
+            .order_by(db.func.ts_rank(vector, tsquery).desc(), Book.id)
+    elif dialect == 'sqlite':
+        # quote every term so FTS5 treats the input as plain words
+        q = ' '.join('"' + term.replace('"', '""') + '"' for term in q.split())
+        query = Book.query.join(db.table('books_fts'), db.text('books_fts.rowid = books.rowid')) \
+            .filter(db.text('books_fts MATCH :q')).params(q=q) \
+            .order_by(db.text('bm25(books_fts)'), Book.id)
+    else:
+        pattern = '%' + q.replace('%', '').replace('_', '') + '%'
+        query = Book.query.filter(db.or_(Book.title.ilike(pattern), Book.author.ilike(pattern))) \
+            .order_by(Book.id)
+    return query.limit(limit).offset(offset).all()
+
+
+@app.route('/books/search', methods=['GET'])
+@use_replica
+@coalesce
+def search_books():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return "Please enter a search term with q", 400
+
+    limit, _ = page_args()
+    if limit is None:
+        return "Please enter a limit between 1 and " + str(config.BOOKS_MAX_PAGE_SIZE), 400
+    offset = request.args.get('offset', '0')
+    if not offset.isdigit():
+        return "Please enter a non negative offset", 400
+    offset = int(offset)
+
+    # ranked best match first, one extra row tells if there is another page
+    books = search_query(q, limit + 1, offset)
+
+    response = jsonify(books_schema.dump(books[:limit]))
+    if len(books) > limit:
+        response.headers['Link'] = '<' + url_for('search_books', q=q, limit=limit, offset=offset + limit) + '>; rel="next"'
+
+    app.logger.info('Search returned %d books', min(len(books), limit))
+
+    return response
+
+
+def book_detail_entry(id):
+    # book and its images in one joined query
+    book = Book.query.options(db.joinedload(Book.images)).get(id)
+    if book is None:
+        return None
 
-    return jsonify(result)
+    if not book.images:
+        response = book_schema.jsonify(book)
+
+    else:
+        result = images_schema.dump(book.images)
+
+        response = jsonify({
+            'id': book.id,
+            'title': book.title,
+            'author': book.author,
+            'isbn': book.isbn,
+            'published_date': book.published_date,
+            'book_created': book.book_created,
+            'user_id': book.user_id,
+            'book_images': result
+        })
+
+    last_modified = book_last_modified(book)
+    if last_modified is not None:
+        last_modified = last_modified.isoformat()
+    return [response.get_data(as_text=True), book_etag(book), last_modified]
 
 
 @app.route("/books/<id>", methods=["GET"])
+@use_replica
+@coalesce
 def book_detail(id):
-    start = time.time()
+    # clients pinned to the primary after a write skip the cache, an entry may
+    # have been filled from a lagging replica
+    entry = book_cache.get(id) if g.use_replica else None
+    if entry is None:
+        entry = book_detail_entry(id)
+        if entry is None:
+            app.logger.info('Book does not exists')
+            return 'Not found', 404
+        book_cache.set(id, entry)
+
+    body, etag, last_modified = entry
+    if last_modified is not None:
+        last_modified = datetime.fromisoformat(last_modified)
+
+    if not_modified(etag, last_modified):
+        app.logger.info('Book not modified')
+        response = app.response_class(status=304)
 
-    book = Book.query.get(id)
-    if book is None:
-        app.logger.info('Book does not exists')
-        return 'Not found', 404
-    
     else:
-        image = Image.query.filter_by(book_id=id).first()
-        
-        image_all = Image.query.filter_by(book_id=id).all()
-        result = images_schema.dump(image_all)
-    
-        if image is None:
-            dur = (time.time() - start) * 1000
-            c.timing("api_get_book_time", dur)
-            c.incr(" api_get_book_count")
-            return book_schema.jsonify(book)
-
-        else:
-            response = jsonify({
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'isbn': book.isbn,
-                'published_date': book.published_date,
-                'book_created': book.book_created,
-                'user_id': book.user_id,
-                'book_images': result
-            })
-            response.status_code = 200
-
-            app.logger.info('Get each book details')
-            dur = (time.time() - start) * 1000
-            c.timing("api_get_book_time", dur)
-            c.incr(" api_get_book_count")
-
-            return response
+        response = app.response_class(body, status=200, mimetype=app.config['JSONIFY_MIMETYPE'])
+
+        app.logger.info('Get each book details')
+
+    return cache_headers(response, etag, last_modified)
 
 
 @app.route("/books/<id>", methods=["DELETE"])
 @auth.login_required
 def book_delete(id):
-    start = time.time()
-
     book = Book.query.get(id)
     if book is None:
-        dur = (time.time() - start) * 1000
-
         app.logger.info('Book does not exist')
-        c.timing("api_delete_book_time", dur)
-        c.incr(" api_delete_book_count")
 
         return 'Not found', 404
 
@@ -381,24 +990,23 @@ def book_delete(id):
             'message': email_message
         }
 
-        sns_client.publish(TopicArn="arn:aws:sns:us-east-1:578033826244:sns_topic",
-                           Message=json.dumps(sns_message))
+        notifier.publish(json.dumps(sns_message))
 
+        # drop the image rows in one statement, the S3 objects are removed
+        # in the background
+        Image.query.filter_by(book_id=book.id).delete(synchronize_session=False)
         db.session.delete(book)
         db.session.commit()
+        book_cache.delete(book.id)
+
+        reaper.delete_prefix(book.id + '/')
 
         app.logger.info('Book deleted')
-        dur = (time.time() - start) * 1000
-        c.timing("api_delete_book_time", dur)
-        c.incr(" api_delete_book_count")
 
         return book_schema.jsonify(book)
 
     else:
         app.logger.info('Unauthorized access to delete book')
-        dur = (time.time() - start) * 1000
-        c.timing("api_delete_book_time", dur)
-        c.incr(" api_delete_book_count")
 
         return 'Unauthorized Access', 401
 
@@ -406,8 +1014,6 @@ def book_delete(id):
 @app.route('/books', methods=['POST'])
 @auth.login_required
 def new_book():
-    start = time.time()
-
     title = request.json.get('title')
     author = request.json.get('author')
     isbn = request.json.get('isbn')
@@ -435,9 +1041,6 @@ def new_book():
     response.status_code = 201
 
     app.logger.info('New book created')
-    dur = (time.time() - start) * 1000
-    c.timing("api_new_book_time", dur)
-    c.incr(" api_new_book_count")
 
     email_message = 'You created a book. Book title: ' + book.title + '. Book link: ' + 'prod.paragshah.me/books/' + book.id
     sns_message = {
@@ -445,10 +1048,114 @@ def new_book():
         'message': email_message
     }
 
-    app.logger.info('** This is SNS message', sns_message)
+    app.logger.info('** This is SNS message %s', sns_message)
+
+    notifier.publish(json.dumps(sns_message))
+
+    return response
+
+
+BOOK_FIELDS = ('title', 'author', 'isbn', 'published_date')
+
+
+# marks an NDJSON line that is not valid JSON, a null row is just None
+INVALID_JSON = object()
+
+
+def bulk_book_rows():
+    # yields (index, row) from a JSON array body or an NDJSON stream
+    if request.mimetype == 'application/x-ndjson':
+        for index, line in enumerate(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, INVALID_JSON
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return
+        for index, row in enumerate(rows):
+            yield index, row
+
+
+def insert_books(rows, ids, errors):
+    try:
+        db.session.bulk_insert_mappings(Book, [row for _, row in rows])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception('Bulk book insert failed')
+        for index, _ in rows:
+            errors.append({'index': index, 'message': 'Could not save book'})
+        return False
+    ids.extend(row['id'] for _, row in rows)
+    return True
+
+
+@app.route('/books/bulk', methods=['POST'])
+@auth.login_required
+def new_books_bulk():
+    ids = []
+    errors = []
+    chunk = []
+    seen = 0
+    db_failed = False
+
+    for index, row in bulk_book_rows():
+        seen += 1
+        if row is INVALID_JSON:
+            errors.append({'index': index, 'message': 'Invalid JSON'})
+            continue
+        if not isinstance(row, dict) or any(not isinstance(row.get(f), str) for f in BOOK_FIELDS):
+            errors.append({'index': index, 'message': 'Please enter title, author, isbn and published_date'})
+            continue
+        # a value the column cannot hold would fail the insert for the whole chunk
+        too_long = [f for f in BOOK_FIELDS if len(row[f]) > Book.__table__.c[f].type.length]
+        if too_long:
+            errors.append({'index': index, 'message': 'Too long: ' + ', '.join(too_long)})
+            continue
+
+        chunk.append((index, {
+            'id': str(uuid.uuid4()),
+            'title': row['title'],
+            'author': row['author'],
+            'isbn': row['isbn'],
+            'published_date': row['published_date'],
+            'user_id': g.user.id
+        }))
+        if len(chunk) == config.BOOKS_BULK_CHUNK_SIZE:
+            db_failed |= not insert_books(chunk, ids, errors)
+            chunk = []
+
+    if chunk:
+        db_failed |= not insert_books(chunk, ids, errors)
+
+    if seen == 0:
+        return "Please supply a JSON array or NDJSON stream of books", 400
+
+    if ids:
+        sns_message = {
+            'user_email': g.user.username,
+            'message': 'You created ' + str(len(ids)) + ' books.'
+        }
+        notifier.publish(json.dumps(sns_message))
+
+    response = jsonify({
+        'created': len(ids),
+        'ids': ids,
+        'errors': errors
+    })
+    # rows the database failed to save are a server error, not the client's
+    if db_failed:
+        response.status_code = 500
+    else:
+        response.status_code = 201 if ids else 400
 
-    sns_client.publish(TopicArn="arn:aws:sns:us-east-1:578033826244:sns_topic",
-                   Message=json.dumps(sns_message))
+    app.logger.info('%d books created in bulk, %d rejected', len(ids), len(errors))
+    c.incr("api_new_books_bulk_rows", len(ids))
 
     return response
 
@@ -462,8 +1169,6 @@ def allowed_file(filename):
 @app.route('/books/<id>/image', methods=['POST'])
 @auth.login_required
 def upload_image(id):
-    start = time.time()
-	
     book_id = id
     if 'file' not in request.files:
         app.logger.info('Image file not provided')
@@ -480,19 +1185,16 @@ def upload_image(id):
         return response
 
     if file and allowed_file(file.filename):
-    
+
+        if Book.query.get(book_id) is None:
+            app.logger.info('Book does not exist')
+            return 'Not found', 404
+
         file_name = secure_filename(file.filename)
-        file.save(os.path.join(UPLOAD_FOLDER, file_name))
         file_id = str(uuid.uuid4())
         s3_object_name = book_id + '/' + file_id + '/' + file_name
 
-        start_s3 = time.time()
-
-        s3 = boto3.client('s3')
-        s3.upload_file(f"/home/ubuntu/{file_name}", bucket, s3_object_name)
-
-        dur_s3 = (time.time() - start_s3) * 1000
-        c.timing("s3_upload_image_time", dur_s3)
+        upload_to_s3(file, s3_object_name)
         
         image = Image(file_name=file_name, file_id=file_id, book_id=book_id,
                       s3_object_name=s3_object_name, user_id=g.user.id)
@@ -500,7 +1202,9 @@ def upload_image(id):
         start_db = time.time()
 
         db.session.add(image)
+        touch_book(book_id)
         db.session.commit()
+        book_cache.delete(book_id)
 
         dur_db = (time.time() - start_db) * 1000
         c.timing("db_upload_image_time", dur_db)
@@ -516,10 +1220,6 @@ def upload_image(id):
 
         app.logger.info('File uploaded to S3 bucket')
 
-        dur = (time.time() - start) * 1000
-        c.timing("api_upload_image_time", dur)
-        c.incr(" api_upload_image_time")
-
         return response
 
     else:
@@ -527,25 +1227,216 @@ def upload_image(id):
         response.status_code = 400
 
         app.logger.info('Invalid image file types')
-        dur = (time.time() - start) * 1000
-        c.timing("api_upload_image_time", dur)
-        c.incr(" api_upload_image_time")
 
         return response
 
 
+@app.route('/books/<id>/images', methods=['POST'])
+@auth.login_required
+def upload_images(id):
+    # keep the part index so results line up with the input, even for
+    # duplicate file names
+    files = [(index, f) for index, f in enumerate(request.files.getlist('file')) if f.filename != '']
+    if not files:
+        app.logger.info('Image files not provided')
+        response = jsonify({'message': 'No file part in the request'})
+        response.status_code = 400
+        return response
+
+    if Book.query.get(id) is None:
+        app.logger.info('Book does not exist')
+        return 'Not found', 404
+
+    # upload concurrently, the request takes about as long as the slowest file
+    results = {}
+    uploads = []
+    for index, file in files:
+        if not allowed_file(file.filename):
+            results[index] = {'index': index, 'file_name': file.filename,
+                              'message': 'Allowed file types are png, jpg, jpeg, gif'}
+            continue
+        file_name = secure_filename(file.filename)
+        file_id = str(uuid.uuid4())
+        s3_object_name = id + '/' + file_id + '/' + file_name
+        image = Image(file_name=file_name, file_id=file_id, book_id=id,
+                      s3_object_name=s3_object_name, user_id=g.user.id)
+        uploads.append((index, image, get_upload_pool().submit(upload_to_s3, file, s3_object_name)))
+
+    images = []
+    for index, image, future in uploads:
+        try:
+            future.result()
+        except Exception:
+            app.logger.exception('Image upload to S3 failed')
+            results[index] = {'index': index, 'file_name': image.file_name, 'message': 'Upload failed'}
+            continue
+        images.append((index, image))
+
+    if images:
+        start_db = time.time()
+
+        try:
+            db.session.add_all([image for _, image in images])
+            touch_book(id)
+            db.session.commit()
+        except Exception:
+            # no row points at the uploaded objects, remove them
+            db.session.rollback()
+            for _, image in images:
+                reaper.delete_prefix(image.s3_object_name)
+            raise
+        book_cache.delete(id)
+
+        dur_db = (time.time() - start_db) * 1000
+        c.timing("db_upload_image_time", dur_db)
+
+    for index, image in images:
+        results[index] = {
+            'index': index,
+            'file_name': image.file_name,
+            's3_object_name': image.s3_object_name,
+            'file_id': image.file_id,
+            'created_date': image.created_date,
+            'user_id': image.user_id
+        }
+
+    response = jsonify([results[index] for index, _ in files])
+    if images:
+        response.status_code = 201
+    elif len(uploads) < len(files):
+        # some files were rejected for their type
+        response.status_code = 400
+    else:
+        # every upload failed on the S3 side
+        response.status_code = 502
+
+    app.logger.info('%d of %d files uploaded to S3 bucket', len(images), len(files))
+
+    return response
+
+
+def json_object():
+    # a body that is not a JSON object reads as empty, so it gets the same 400
+    body = request.get_json(silent=True)
+    return body if isinstance(body, dict) else {}
+
+
+def upload_serializer():
+    return Serializer(app.config['SECRET_KEY'], expires_in=config.S3_PRESIGNED_EXPIRATION,
+                      salt='image-upload')
+
+
+@app.route('/books/<id>/image/upload-url', methods=['POST'])
+@auth.login_required
+def image_upload_url(id):
+    file_name = json_object().get('file_name')
+    if not isinstance(file_name, str) or not allowed_file(secure_filename(file_name)):
+        app.logger.info('Invalid image file name for upload url')
+        response = jsonify({'message': 'Please enter a file_name of type png, jpg, jpeg or gif'})
+        response.status_code = 400
+        return response
+
+    if Book.query.get(id) is None:
+        app.logger.info('Book does not exist')
+        return 'Not found', 404
+
+    file_name = secure_filename(file_name)
+    file_id = str(uuid.uuid4())
+    s3_object_name = id + '/' + file_id + '/' + file_name
+
+    # the client uploads straight to S3 and sends the token back to confirm
+    presigned = get_s3_client().generate_presigned_post(
+        bucket, s3_object_name,
+        Conditions=[['content-length-range', 1, config.S3_PRESIGNED_MAX_SIZE]],
+        ExpiresIn=config.S3_PRESIGNED_EXPIRATION)
+    upload_token = upload_serializer().dumps({
+        'book_id': id,
+        'file_id': file_id,
+        'file_name': file_name,
+        'user_id': g.user.id
+    }).decode()
+
+    response = jsonify({
+        'file_id': file_id,
+        'file_name': file_name,
+        's3_object_name': s3_object_name,
+        'url': presigned['url'],
+        'fields': presigned['fields'],
+        'upload_token': upload_token,
+        'expires_in': config.S3_PRESIGNED_EXPIRATION
+    })
+    response.status_code = 201
+
+    app.logger.info('Presigned image upload url created')
+
+    return response
+
+
+@app.route('/books/<id>/image/confirm', methods=['POST'])
+@auth.login_required
+def confirm_image_upload(id):
+    upload_token = json_object().get('upload_token')
+    try:
+        if not isinstance(upload_token, str):
+            raise BadSignature('upload_token must be a string')
+        data = upload_serializer().loads(upload_token)
+    except (BadSignature, SignatureExpired):
+        app.logger.info('Invalid image upload token')
+        response = jsonify({'message': 'Invalid or expired upload_token'})
+        response.status_code = 400
+        return response
+
+    if data['book_id'] != id or data['user_id'] != g.user.id:
+        app.logger.info('Unauthorized image upload confirmation')
+        return 'Unauthorized Access', 401
+
+    s3_object_name = id + '/' + data['file_id'] + '/' + data['file_name']
+
+    try:
+        get_s3_client().head_object(Bucket=bucket, Key=s3_object_name)
+    except botocore.exceptions.ClientError:
+        app.logger.info('Confirmed image not found in S3 bucket')
+        response = jsonify({'message': 'File has not been uploaded'})
+        response.status_code = 400
+        return response
+
+    # confirming twice returns the existing image
+    image = Image.query.get(data['file_id'])
+    if image is None:
+        image = Image(file_name=data['file_name'], file_id=data['file_id'], book_id=id,
+                      s3_object_name=s3_object_name, user_id=g.user.id)
+
+        start_db = time.time()
+
+        db.session.add(image)
+        touch_book(id)
+        db.session.commit()
+        book_cache.delete(id)
+
+        dur_db = (time.time() - start_db) * 1000
+        c.timing("db_upload_image_time", dur_db)
+
+    response = jsonify({
+        'file_name': image.file_name,
+        's3_object_name': image.s3_object_name,
+        'file_id': image.file_id,
+        'created_date': image.created_date,
+        'user_id': image.user_id
+    })
+    response.status_code = 201
+
+    app.logger.info('Direct image upload confirmed')
+
+    return response
+
+
 @app.route('/books/<book_id>/image/<file_id>', methods=['DELETE'])
 @auth.login_required
 def delete_image(book_id, file_id):
-    start = time.time()
-
     image = Image.query.get(file_id)
     if image is None:
 
         app.logger.info('Image not found for deletion')
-        dur = (time.time() - start) * 1000
-        c.timing("api_delete_image_time", dur)
-        c.incr(" api_delete_image_time")
 
         return 'Not found', 404
 
@@ -554,33 +1445,21 @@ def delete_image(book_id, file_id):
         start_db = time.time()
 
         db.session.delete(image)
+        touch_book(image.book_id)
         db.session.commit()
+        book_cache.delete(image.book_id)
 
         dur_db = (time.time() - start_db) * 1000
         c.timing("db_delete_image_time", dur_db)
 
-        start_s3 = time.time()
-
-        s3 = boto3.resource('s3')
-        prefix = book_id + '/' + file_id + '/'
-        bucket_id = s3.Bucket(bucket)
-        bucket_id.objects.filter(Prefix=prefix).delete()
-
-        dur_s3 = (time.time() - start_s3) * 1000
-        c.timing("s3_upload_image_time", dur_s3)
+        reaper.delete_prefix(image.book_id + '/' + image.file_id + '/')
 
         app.logger.info('Image deleted')
-        dur = (time.time() - start) * 1000
-        c.timing("api_delete_image_time", dur)
-        c.incr(" api_delete_image_time")
 
         return image_schema.jsonify(image), 204
     
     else:
         app.logger.info('Unauthorized access to delete image')
-        dur = (time.time() - start) * 1000
-        c.timing("api_delete_image_time", dur)
-        c.incr(" api_delete_image_time")
 
         return 'Unauthorized Access', 401
 
@@ -588,4 +1467,6 @@ def delete_image(book_id, file_id):
 if __name__ == '__main__':
     if not os.path.exists('webapp.sqlite'):
         db.create_all()
-    app.run(host="0.0.0.0", port=5000, debug=True)
+        create_search_index()
+    # development only, production runs gunicorn with gunicorn.conf.py
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
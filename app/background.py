@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Everything that must not cross a fork (sockets, connection pools, threads,
+# process pools) is reset in the child through this one hook.
+per_process = weakref.WeakSet()
+fork_callbacks = []
+
+
+def after_fork(fn):
+    """Runs fn in every forked child, before it handles any work."""
+    fork_callbacks.append(fn)
+    return fn
+
+
+def reset_in_child():
+    for holder in list(per_process):
+        holder.reset()
+    for fn in fork_callbacks:
+        fn()
+
+
+os.register_at_fork(after_in_child=reset_in_child)
+
+
+class PerProcess:
+    """Holds one value per process, made by factory on first use.
+
+    A forked child starts empty and builds its own value, so sockets, pools
+    and threads are never shared with the parent.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.value = None
+        self.lock = threading.Lock()
+        per_process.add(self)
+
+    def get(self):
+        value = self.value
+        if value is None:
+            with self.lock:
+                if self.value is None:
+                    self.value = self.factory()
+                value = self.value
+        return value
+
+    def reset(self):
+        # the lock may have been held by a thread that does not exist here
+        self.lock = threading.Lock()
+        self.value = None
+
+
+class BatchWorker:
+    """Drains a bounded queue in batches on background threads.
+
+    put() never blocks the request: when the queue is full the item is
+    dropped and counted. Each thread gathers up to max_batch items, waiting
+    at most batch_wait seconds for more, and hands them to handle().
+    Subclasses implement handle() and may use retry() for items that fail.
+    Stats are reported as <name>_dropped_count, <name>_queue_depth,
+    <name>_retry_count and <name>_failed_count.
+    """
+
+    def __init__(self, name, stats, queue_size=1000, workers=1, max_batch=None,
+                 max_retries=3, backoff=0.2, batch_wait=0.05):
+        self.name = name
+        self.stats = stats
+        self.queue_size = queue_size
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_wait = batch_wait
+        self.state = PerProcess(self.start)
+
+    def start(self):
+        work = queue.Queue(maxsize=self.queue_size)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, args=(work,), daemon=True,
+                                      name='%s-%d' % (self.name, i))
+            thread.start()
+            threads.append(thread)
+        return work, threads
+
+    @property
+    def queue(self):
+        return self.state.get()[0]
+
+    def put(self, item):
+        work = self.queue
+        try:
+            work.put_nowait(item)
+        except queue.Full:
+            logger.error('%s queue full, dropping an item', self.name)
+            self.stats.incr(self.name + "_dropped_count")
+            return False
+        self.stats.gauge(self.name + "_queue_depth", work.qsize())
+        return True
+
+    def run(self, work):
+        while True:
+            item = work.get()
+            if item is None:
+                work.task_done()
+                return
+
+            batch = [item]
+            deadline = time.time() + self.batch_wait
+            stop = False
+            while self.max_batch is None or len(batch) < self.max_batch:
+                try:
+                    item = work.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self.handle(batch)
+            except Exception:
+                logger.exception('%s failed', self.name)
+            finally:
+                for _ in range(len(batch) + stop):
+                    work.task_done()
+
+            self.stats.gauge(self.name + "_queue_depth", work.qsize())
+            if stop:
+                return
+
+    def handle(self, batch):
+        raise NotImplementedError
+
+    def retry(self, items, attempt):
+        # attempt(items) returns the items that failed, those are tried again
+        # with exponential backoff up to max_retries times
+        for retry in range(self.max_retries + 1):
+            items = attempt(items)
+            if not items:
+                return
+            if retry < self.max_retries:
+                self.stats.incr(self.name + "_retry_count", len(items))
+                time.sleep(self.backoff * 2 ** retry)
+
+        logger.error('%s gave up on %d items', self.name, len(items))
+        self.stats.incr(self.name + "_failed_count", len(items))
+
+    def stop(self, timeout=5):
+        # one sentinel per thread, behind the pending items
+        if self.state.value is None:
+            return
+        work, threads = self.state.value
+        for _ in threads:
+            try:
+                work.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(timeout)
+        self.state.reset()
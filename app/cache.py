@@ -0,0 +1,139 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from background import PerProcess
+
+logger = logging.getLogger(__name__)
+
+
+class Cache:
+    """Counts hits and misses and reports them, with the hit ratio, to statsd."""
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+            self.stats.incr(self.name + "_cache_hit_count")
+        else:
+            self.misses += 1
+            self.stats.incr(self.name + "_cache_miss_count")
+        self.stats.gauge(self.name + "_cache_hit_ratio", round(self.hits / (self.hits + self.misses), 4))
+
+
+class LocalCache(Cache):
+    """Bounded LRU cache with a TTL, local to the process."""
+
+    def __init__(self, stats, name, max_size=1024, ttl=30, clock=time.time):
+        Cache.__init__(self, stats, name)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] < self.clock():
+                del self.entries[key]
+                self.stats.incr(self.name + "_cache_expired_count")
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        self.record(entry is not None)
+        return None if entry is None else entry[0]
+
+    def set(self, key, value):
+        evicted = 0
+        with self.lock:
+            self.entries[key] = (value, self.clock() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                evicted += 1
+            size = len(self.entries)
+        if evicted:
+            self.stats.incr(self.name + "_cache_eviction_count", evicted)
+        self.stats.gauge(self.name + "_cache_size", size)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class RedisCache(Cache):
+    """Cache shared by every worker, values are stored as JSON with a TTL.
+
+    Needs the redis package. Errors are logged and read as a miss, so the
+    database stays the source of truth when redis is away.
+    """
+
+    def __init__(self, stats, name, url, ttl=30):
+        import redis
+
+        Cache.__init__(self, stats, name)
+        self.redis = redis
+        self.ttl = ttl
+        self.client = PerProcess(lambda: redis.Redis.from_url(url))
+
+    def get_client(self):
+        return self.client.get()
+
+    def get(self, key):
+        try:
+            value = self.get_client().get(self.name + ':' + key)
+        except self.redis.RedisError:
+            logger.exception('Cache get failed')
+            value = None
+        self.record(value is not None)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        try:
+            self.get_client().setex(self.name + ':' + key, self.ttl, json.dumps(value))
+        except self.redis.RedisError:
+            logger.exception('Cache set failed')
+
+    def delete(self, key):
+        try:
+            self.get_client().delete(self.name + ':' + key)
+        except self.redis.RedisError:
+            logger.exception('Cache delete failed')
+
+
+class DictCache(Cache):
+    """Keeps every entry with no expiry or size limit, for tests."""
+
+    def __init__(self, stats, name):
+        Cache.__init__(self, stats, name)
+        self.entries = {}
+
+    def get(self, key):
+        value = self.entries.get(key)
+        self.record(value is not None)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = value
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
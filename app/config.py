@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 
 db_name = os.environ['RDS_DB_NAME']
 db_endpoint = os.environ['RDS_DB_ENDPOINT']
@@ -19,5 +20,99 @@ SQLALCHEMY_DATABASE_URI = 'postgresql://'+db_username+':'+db_password+'@'+db_end
 SQLALCHEMY_COMMIT_ON_TEARDOWN = True
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# optional read replica for safe GET routes
+db_replica_endpoint = os.environ.get('RDS_DB_REPLICA_ENDPOINT')
+SQLALCHEMY_BINDS = {}
+if db_replica_endpoint:
+    SQLALCHEMY_BINDS['replica'] = 'postgresql://'+db_username+':'+db_password+'@'+db_replica_endpoint+'/'+db_name
+# seconds a client keeps reading from the primary after a write
+REPLICA_READ_AFTER_WRITE = int(os.environ.get('REPLICA_READ_AFTER_WRITE', 5))
+
+# pool_size and max_overflow are dropped for SQLite URIs when the engine is made
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+}
+
+# statsd metrics: 'udp' sends to the CloudWatch agent, 'memory' and 'null'
+# are for tests
+METRICS_BACKEND = os.environ.get('METRICS_BACKEND', 'udp')
+STATSD_HOST = os.environ.get('STATSD_HOST', 'localhost')
+STATSD_PORT = int(os.environ.get('STATSD_PORT', 8125))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+# sample rate for the per request metrics, 1.0 records every request
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+
+# JSON line logging written from a background thread, every worker appends
+# to the same file and scripts/logrotate.conf rotates it
+LOG_FILE = os.environ.get('LOG_FILE', '/home/ubuntu/webapp/app/csye6225.log')
+# share of INFO records that are written, warnings and errors are always kept
+LOG_INFO_SAMPLE_RATE = float(os.environ.get('LOG_INFO_SAMPLE_RATE', 1.0))
+
+# requests slower than this many milliseconds are logged and counted
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+# bcrypt cost for new hashes, older hashes are upgraded on the next login
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# processes that hash and verify passwords, and how many calls may wait, in
+# each gunicorn worker; the machine runs WEB_CONCURRENCY * HASH_WORKERS of
+# them, so by default the cores are split across the gunicorn workers
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', max(1, multiprocessing.cpu_count() // WEB_CONCURRENCY)))
+HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE', 4))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+
+# verified credential cache used by basic auth
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 300))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+
+# lifetime in seconds of tokens issued by /v1/user/token
+AUTH_TOKEN_EXPIRATION = int(os.environ.get('AUTH_TOKEN_EXPIRATION', 600))
+
+# page sizes for GET /books
+BOOKS_PAGE_SIZE = int(os.environ.get('BOOKS_PAGE_SIZE', 100))
+BOOKS_MAX_PAGE_SIZE = int(os.environ.get('BOOKS_MAX_PAGE_SIZE', 1000))
+
+# SNS notifications are published in batches from background threads
+SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:578033826244:sns_topic')
+SNS_QUEUE_SIZE = int(os.environ.get('SNS_QUEUE_SIZE', 1000))
+SNS_WORKERS = int(os.environ.get('SNS_WORKERS', 2))
+SNS_MAX_RETRIES = int(os.environ.get('SNS_MAX_RETRIES', 3))
+
+# S3 multipart upload tuning
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 4))
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+# threads shared by multi-file image uploads
+S3_UPLOAD_WORKERS = int(os.environ.get('S3_UPLOAD_WORKERS', 8))
+
+# background deletion of S3 objects
+S3_REAPER_QUEUE_SIZE = int(os.environ.get('S3_REAPER_QUEUE_SIZE', 10000))
+S3_REAPER_MAX_RETRIES = int(os.environ.get('S3_REAPER_MAX_RETRIES', 3))
+
+# presigned direct-to-S3 image uploads
+S3_PRESIGNED_EXPIRATION = int(os.environ.get('S3_PRESIGNED_EXPIRATION', 900))
+S3_PRESIGNED_MAX_SIZE = int(os.environ.get('S3_PRESIGNED_MAX_SIZE', 100 * 1024 * 1024))
+
+# rows per insert and commit for POST /books/bulk
+BOOKS_BULK_CHUNK_SIZE = int(os.environ.get('BOOKS_BULK_CHUNK_SIZE', 1000))
+
+# Cache-Control max-age in seconds for book responses
+BOOKS_CACHE_MAX_AGE = int(os.environ.get('BOOKS_CACHE_MAX_AGE', 30))
+
+# server side cache of GET /books/<id> bodies: 'local' is per worker, so other
+# workers only see a change once the entry expires; 'redis' is shared by every
+# worker; 'dict' is for tests and 'null' turns the cache off
+BOOK_CACHE_BACKEND = os.environ.get('BOOK_CACHE_BACKEND', 'local')
+BOOK_CACHE_SIZE = int(os.environ.get('BOOK_CACHE_SIZE', 1024))
+BOOK_CACHE_TTL = int(os.environ.get('BOOK_CACHE_TTL', 30))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# seconds a request waits on an identical in-flight read before running it itself
+COALESCE_TIMEOUT = float(os.environ.get('COALESCE_TIMEOUT', 10))
+
 # print(SQLALCHEMY_DATABASE_URI)
 # print(SQLALCHEMY_DATABASE_URI_TEST)
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '5000')
+
+# CPU bound work (bcrypt, serialization) scales with processes, the S3, SNS
+# and database calls are I/O bound and share a process through threads
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# load the app once in the master, workers fork from it and rebuild their
+# connections, pools and threads on first use (see background.py)
+preload_app = True
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+max_requests = 10000
+max_requests_jitter = 1000
+
+pidfile = os.environ.get('GUNICORN_PIDFILE', '/tmp/webapp-gunicorn.pid')
+errorlog = '-'
+loglevel = 'info'
+
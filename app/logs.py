@@ -0,0 +1,105 @@
+import json
+import queue
+import random
+import time
+import logging
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from flask import g, request, has_request_context
+
+from background import PerProcess
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON line."""
+
+    def format(self, record):
+        event = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key in ('request_id', 'method', 'path', 'status', 'latency_ms'):
+            if hasattr(record, key):
+                event[key] = getattr(record, key)
+        if record.exc_info:
+            event['exc'] = self.formatException(record.exc_info)
+        return json.dumps(event)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the request id and latency so far while still on the request thread."""
+
+    def filter(self, record):
+        if has_request_context():
+            if 'request_id' in g:
+                record.request_id = g.request_id
+            record.method = request.method
+            record.path = request.path
+            if 'request_start' in g and not hasattr(record, 'latency_ms'):
+                record.latency_ms = round((time.time() - g.request_start) * 1000, 3)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a sample of INFO and lower records, warnings and errors always pass."""
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Hands records to a listener thread that formats and writes them.
+
+    The queue and listener are made per process on first use.
+    """
+
+    def __init__(self, handler, queue_size=10000):
+        QueueHandler.__init__(self, None)
+        self.handler = handler
+        self.queue_size = queue_size
+        self.listener = PerProcess(self.start)
+
+    def start(self):
+        listener = QueueListener(queue.Queue(maxsize=self.queue_size), self.handler,
+                                 respect_handler_level=True)
+        listener.start()
+        return listener
+
+    def prepare(self, record):
+        # keep the record as is, formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.listener.get().queue.put_nowait(record)
+        except queue.Full:
+            # drop rather than block the request
+            pass
+
+    def stop(self):
+        if self.listener.value is not None:
+            self.listener.value.stop()
+            self.listener.reset()
+
+
+def setup_logging(filename, sample_rate, level=logging.INFO):
+    # the gunicorn workers share the file, so none of them rotates it; each
+    # reopens the file once logrotate has moved it away
+    file_handler = WatchedFileHandler(filename)
+    file_handler.setFormatter(JsonFormatter())
+
+    handler = AsyncQueueHandler(file_handler)
+    handler.addFilter(SamplingFilter(sample_rate))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    return handler
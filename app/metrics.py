@@ -0,0 +1,141 @@
+import random
+import socket
+import threading
+from datetime import timedelta
+
+from background import PerProcess
+
+
+class UDPSink:
+    """Sends packets to a statsd listener over UDP."""
+
+    def __init__(self, host='localhost', port=8125):
+        self.addr = (socket.gethostbyname(host), port)
+        self.sock = PerProcess(lambda: socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+
+    def send(self, packet):
+        try:
+            self.sock.get().sendto(packet.encode('ascii'), self.addr)
+        except (OSError, UnicodeError):
+            # metrics are best effort
+            pass
+
+
+class MemorySink:
+    """Keeps every packet in memory, for tests."""
+
+    def __init__(self):
+        self.packets = []
+
+    def send(self, packet):
+        self.packets.append(packet)
+
+    @property
+    def lines(self):
+        return [line for packet in self.packets for line in packet.split('\n')]
+
+
+class NullSink:
+    def send(self, packet):
+        pass
+
+
+class BufferedStatsClient:
+    """statsd compatible client that aggregates metrics in process.
+
+    Counters are summed and gauges keep their last value between flushes;
+    timings are kept individually. A background thread flushes every
+    flush_interval seconds, or sooner once max_buffer timings are pending,
+    packing the lines into datagrams of at most max_packet_size bytes.
+    """
+
+    def __init__(self, sink, flush_interval=1.0, max_buffer=500, max_packet_size=1432):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_packet_size = max_packet_size
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = []
+        self.thread = PerProcess(self.start_thread)
+
+    def start_thread(self):
+        thread = threading.Thread(target=self.run, name='statsd-flush', daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        self.thread.get()
+
+    def incr(self, stat, count=1, rate=1):
+        if rate < 1 and random.random() > rate:
+            return
+        self.start()
+        with self.lock:
+            # scale sampled counts back up so the sum stays an estimate of the total
+            self.counters[stat] = self.counters.get(stat, 0) + count / rate
+
+    def decr(self, stat, count=1, rate=1):
+        self.incr(stat, -count, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        if rate < 1 and random.random() > rate:
+            return
+        self.start()
+        with self.lock:
+            if delta:
+                self.gauges[stat] = self.gauges.get(stat, 0) + value
+            else:
+                self.gauges[stat] = value
+
+    def timing(self, stat, delta, rate=1):
+        if rate < 1 and random.random() > rate:
+            return
+        if isinstance(delta, timedelta):
+            delta = delta.total_seconds() * 1000
+        line = '%s:%0.6f|ms' % (stat, delta)
+        if rate < 1:
+            line += '|@%s' % rate
+        self.start()
+        with self.lock:
+            self.timers.append(line)
+            full = len(self.timers) >= self.max_buffer
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+            timers, self.timers = self.timers, []
+
+        lines = ['%s:%s|c' % (stat, format_value(value)) for stat, value in counters.items()]
+        # a negative gauge would be read as a delta, reset to 0 first
+        for stat, value in gauges.items():
+            if value < 0:
+                lines.append('%s:0|g' % stat)
+            lines.append('%s:%s|g' % (stat, format_value(value)))
+        lines.extend(timers)
+
+        packet = ''
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > self.max_packet_size:
+                self.sink.send(packet)
+                packet = ''
+            packet = packet + '\n' + line if packet else line
+        if packet:
+            self.sink.send(packet)
+
+
+def format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return '%0.6f' % value
@@ -27,6 +27,18 @@ config.set_main_option(
     str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# full-text search objects are made by hand (Postgres in revision 4f2d9b7e1a35,
+# SQLite in app.create_search_index), keep autogenerate from dropping them
+UNMANAGED_OBJECTS = ('search_vector', 'ix_books_search_vector')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and compare_to is None and \
+            (name in UNMANAGED_OBJECTS or name.startswith('books_fts')):
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -47,7 +59,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -83,6 +96,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,28 @@
+"""empty message
+
+Revision ID: 3c7e2a9d41f0
+Revises: 61dd001a6505
+Create Date: 2026-10-18 09:12:31.482117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7e2a9d41f0'
+down_revision = '61dd001a6505'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # images whose book was already deleted would violate the new foreign key
+    op.execute('DELETE FROM images WHERE book_id NOT IN (SELECT id FROM books)')
+    op.create_index(op.f('ix_images_book_id'), 'images', ['book_id'], unique=False)
+    op.create_foreign_key('images_book_id_fkey', 'images', 'books', ['book_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('images_book_id_fkey', 'images', type_='foreignkey')
+    op.drop_index(op.f('ix_images_book_id'), table_name='images')
@@ -0,0 +1,36 @@
+"""empty message
+
+Revision ID: 4f2d9b7e1a35
+Revises: e5b8f13a7c64
+Create Date: 2026-10-18 13:41:52.664019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2d9b7e1a35'
+down_revision = 'e5b8f13a7c64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Postgres only: the earlier revisions cannot run on SQLite, where
+    # db.create_all and create_search_index build the schema instead
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # generated columns need Postgres 12 or newer
+    op.execute("ALTER TABLE books ADD COLUMN search_vector tsvector "
+               "GENERATED ALWAYS AS (to_tsvector('english', "
+               "coalesce(title, '') || ' ' || coalesce(author, ''))) STORED")
+    op.create_index('ix_books_search_vector', 'books', ['search_vector'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_books_search_vector', table_name='books')
+    op.drop_column('books', 'search_vector')
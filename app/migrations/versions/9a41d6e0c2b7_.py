@@ -0,0 +1,27 @@
+"""empty message
+
+Revision ID: 9a41d6e0c2b7
+Revises: 3c7e2a9d41f0
+Create Date: 2026-10-18 10:03:48.915206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a41d6e0c2b7'
+down_revision = '3c7e2a9d41f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('books', sa.Column('book_updated', sa.String(), nullable=True))
+    op.add_column('books', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.execute('UPDATE books SET book_updated = book_created')
+
+
+def downgrade():
+    op.drop_column('books', 'version')
+    op.drop_column('books', 'book_updated')
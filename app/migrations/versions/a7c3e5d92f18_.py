@@ -0,0 +1,31 @@
+"""empty message
+
+Revision ID: a7c3e5d92f18
+Revises: 4f2d9b7e1a35
+Create Date: 2026-10-18 14:58:20.117436
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5d92f18'
+down_revision = '4f2d9b7e1a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### filters and sorts on GET /books, id keeps keyset pagination indexed ###
+    op.create_index('ix_books_isbn_id', 'books', ['isbn', 'id'], unique=False)
+    op.create_index('ix_books_author_id', 'books', ['author', 'id'], unique=False)
+    op.create_index('ix_books_title_id', 'books', ['title', 'id'], unique=False)
+    op.create_index('ix_books_book_created_id', 'books', ['book_created', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_books_book_created_id', table_name='books')
+    op.drop_index('ix_books_title_id', table_name='books')
+    op.drop_index('ix_books_author_id', table_name='books')
+    op.drop_index('ix_books_isbn_id', table_name='books')
@@ -0,0 +1,27 @@
+"""empty message
+
+Revision ID: d63f0b2e8c91
+Revises: a7c3e5d92f18
+Create Date: 2026-10-18 16:12:44.502913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd63f0b2e8c91'
+down_revision = 'a7c3e5d92f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ### user_id filter pages on (user_id, id) like the other filters ###
+    op.create_index('ix_books_user_id_id', 'books', ['user_id', 'id'], unique=False)
+    op.drop_index(op.f('ix_books_user_id'), table_name='books')
+
+
+def downgrade():
+    op.create_index(op.f('ix_books_user_id'), 'books', ['user_id'], unique=False)
+    op.drop_index('ix_books_user_id_id', table_name='books')
@@ -0,0 +1,47 @@
+"""empty message
+
+Revision ID: e5b8f13a7c64
+Revises: 9a41d6e0c2b7
+Create Date: 2026-10-18 11:26:07.308452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8f13a7c64'
+down_revision = '9a41d6e0c2b7'
+branch_labels = None
+depends_on = None
+
+# (table, column) pairs stored as strings until now
+TIMESTAMP_COLUMNS = [
+    ('users', 'account_created'),
+    ('users', 'account_updated'),
+    ('books', 'book_created'),
+    ('books', 'book_updated'),
+    ('images', 'created_date'),
+]
+
+
+def upgrade():
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, existing_type=sa.String(), type_=sa.DateTime(),
+                        postgresql_using=column + '::timestamp without time zone')
+
+    op.create_index(op.f('ix_books_user_id'), 'books', ['user_id'], unique=False)
+    op.create_index(op.f('ix_images_user_id'), 'images', ['user_id'], unique=False)
+    op.create_foreign_key('books_user_id_fkey', 'books', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('images_user_id_fkey', 'images', 'users', ['user_id'], ['id'])
+
+
+def downgrade():
+    op.drop_constraint('images_user_id_fkey', 'images', type_='foreignkey')
+    op.drop_constraint('books_user_id_fkey', 'books', type_='foreignkey')
+    op.drop_index(op.f('ix_images_user_id'), table_name='images')
+    op.drop_index(op.f('ix_books_user_id'), table_name='books')
+
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, existing_type=sa.DateTime(), type_=sa.String(),
+                        postgresql_using=column + '::varchar')
@@ -0,0 +1,52 @@
+import time
+import logging
+
+from background import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+# SNS accepts at most 10 entries per publish_batch call
+MAX_BATCH_SIZE = 10
+
+
+class NotificationDispatcher(BatchWorker):
+    """Publishes SNS messages from background threads.
+
+    Requests only enqueue the message; worker threads drain the queue in
+    batches of up to 10 with publish_batch and retry failed entries with
+    exponential backoff. get_client returns any object with a boto3 style
+    publish_batch method, so a local stub can be dropped in for testing.
+    """
+
+    def __init__(self, get_client, topic_arn, stats, queue_size=1000, workers=2,
+                 max_retries=3, backoff=0.2, batch_wait=0.05):
+        BatchWorker.__init__(self, 'sns', stats, queue_size=queue_size, workers=workers,
+                             max_batch=MAX_BATCH_SIZE, max_retries=max_retries,
+                             backoff=backoff, batch_wait=batch_wait)
+        self.get_client = get_client
+        self.topic_arn = topic_arn
+
+    def publish(self, message):
+        return self.put((time.time(), message))
+
+    def handle(self, batch):
+        now = time.time()
+        for queued_at, _ in batch:
+            self.stats.timing("sns_queue_latency", (now - queued_at) * 1000)
+
+        self.retry({str(i): message for i, (_, message) in enumerate(batch)}, self.publish_batch)
+
+    def publish_batch(self, entries):
+        start = time.time()
+        try:
+            response = self.get_client().publish_batch(
+                TopicArn=self.topic_arn,
+                PublishBatchRequestEntries=[{'Id': i, 'Message': m} for i, m in entries.items()])
+            failed = [f['Id'] for f in response.get('Failed', [])]
+        except Exception:
+            logger.exception('SNS publish_batch error')
+            failed = list(entries)
+        self.stats.timing("sns_publish_batch_time", (time.time() - start) * 1000)
+
+        self.stats.incr("sns_published_count", len(entries) - len(failed))
+        return {i: entries[i] for i in failed}
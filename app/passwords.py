@@ -0,0 +1,103 @@
+import sys
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+from background import PerProcess
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hash pool is saturated or too slow to answer."""
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def check_password(password_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+    except ValueError:
+        return False
+
+
+def hash_rounds(password_hash):
+    # hashes look like $2b$12$<salt and digest>
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class HashPool:
+    """Runs bcrypt on a pool of worker processes.
+
+    At most workers + queue_size calls are in flight; past that, or when a
+    call takes longer than timeout seconds, HashPoolBusy is raised so the
+    request can be turned away instead of piling up on the CPU.
+    """
+
+    def __init__(self, rounds, workers=2, queue_size=16, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pool = PerProcess(self.start)
+
+    def start(self):
+        # forkserver, so the pool is not forked from a worker whose other
+        # threads may hold locks; the slots count this process' jobs only
+        executor = ProcessPoolExecutor(max_workers=self.workers,
+                                       mp_context=multiprocessing.get_context('forkserver'))
+        return executor, threading.BoundedSemaphore(self.workers + self.queue_size)
+
+    def run(self, fn, *args):
+        executor, slots = self.pool.get()
+        if not slots.acquire(blocking=False):
+            raise HashPoolBusy()
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        # the slot is held until the job is done or cancelled, so a job left
+        # behind by a timeout still counts against the queue
+        future.add_done_callback(lambda f: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashPoolBusy()
+
+    def hash(self, password):
+        return self.run(hash_password, password, self.rounds)
+
+    def check(self, password_hash, password):
+        return self.run(check_password, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) != self.rounds
+
+    def shutdown(self):
+        if self.pool.value is not None:
+            self.pool.value[0].shutdown(wait=False)
+            self.pool.reset()
+
+
+def benchmark(rounds_list, seconds=2.0):
+    # single process, so the rate is hashes/s for one core
+    for rounds in rounds_list:
+        count = 0
+        start = time.time()
+        while time.time() - start < seconds:
+            hash_password('Benchmark@123', rounds)
+            count += 1
+        print('cost %2d: %8.2f hashes/s per core' % (rounds, count / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    # python passwords.py [cost ...]
+    benchmark([int(r) for r in sys.argv[1:]] or [10, 11, 12, 13, 14])
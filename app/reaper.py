@@ -0,0 +1,69 @@
+import time
+import logging
+
+from background import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+# S3 accepts at most 1000 keys per delete_objects call
+MAX_DELETE_KEYS = 1000
+
+
+class S3Reaper(BatchWorker):
+    """Deletes S3 objects under the given prefixes from a background thread.
+
+    Requests only enqueue a prefix. The worker lists each prefix, packs the
+    keys into delete_objects calls of up to 1000 keys and retries keys that
+    fail with exponential backoff. get_client is called for every batch so
+    the process wide S3 client is used.
+    """
+
+    def __init__(self, get_client, bucket, stats, queue_size=10000,
+                 max_retries=3, backoff=0.5, batch_wait=0.1):
+        BatchWorker.__init__(self, 's3_reaper', stats, queue_size=queue_size, workers=1,
+                             max_retries=max_retries, backoff=backoff, batch_wait=batch_wait)
+        self.get_client = get_client
+        self.bucket = bucket
+
+    def delete_prefix(self, prefix):
+        return self.put(prefix)
+
+    def handle(self, prefixes):
+        keys = []
+        for prefix in prefixes:
+            for key in self.list_keys(prefix):
+                keys.append(key)
+                if len(keys) == MAX_DELETE_KEYS:
+                    self.retry(keys, self.delete_keys)
+                    keys = []
+        if keys:
+            self.retry(keys, self.delete_keys)
+
+    def list_keys(self, prefix):
+        paginator = self.get_client().get_paginator('list_objects_v2')
+        for attempt in range(self.max_retries + 1):
+            try:
+                keys = []
+                for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                    keys.extend(obj['Key'] for obj in page.get('Contents', []))
+                return keys
+            except Exception:
+                logger.exception('S3 reaper could not list %s', prefix)
+                time.sleep(self.backoff * 2 ** attempt)
+        self.stats.incr("s3_reaper_failed_count")
+        return []
+
+    def delete_keys(self, keys):
+        start = time.time()
+        try:
+            response = self.get_client().delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+            failed = [error['Key'] for error in response.get('Errors', [])]
+        except Exception:
+            logger.exception('S3 delete_objects error')
+            failed = keys
+        self.stats.timing("s3_reaper_delete_time", (time.time() - start) * 1000)
+
+        self.stats.incr("s3_reaper_deleted_count", len(keys) - len(failed))
+        return failed
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its settings from the environment at import time
+os.environ.setdefault('RDS_DB_NAME', 'webapp')
+os.environ.setdefault('RDS_DB_ENDPOINT', 'localhost')
+os.environ.setdefault('RDS_DB_USERNAME', 'postgres')
+os.environ.setdefault('RDS_DB_PASSWORD', 'postgres')
+os.environ.setdefault('S3_BUCKET_NAME', 'webapp-test')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('METRICS_BACKEND', 'null')
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.gettempdir(), 'webapp-test.log'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+import pytest
+
+import app as webapp
+
+
+@pytest.fixture(scope='module')
+def client():
+    webapp.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    webapp.app.config['SQLALCHEMY_BINDS'] = {}
+    webapp.app.config['TESTING'] = True
+    with webapp.app.app_context():
+        webapp.db.create_all()
+        webapp.db.session.add(webapp.User(id='u1', username='a@b.com', password_hash='x',
+                                             first_name='a', last_name='b'))
+        for i in range(50):
+            webapp.db.session.add(webapp.Book(title='t%d' % (i % 7), author='a%d' % (i % 5),
+                                              isbn='i%d' % (i % 3), published_date='2020', user_id='u1'))
+        webapp.db.session.commit()
+        yield webapp.app.test_client()
+
+
+def query_plans(client, url):
+    # EXPLAIN QUERY PLAN for every statement GET /books runs for this url
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    webapp.event.listen(webapp.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        webapp.event.remove(webapp.db.engine, 'before_cursor_execute', record)
+    assert response.status_code == 200, response.data
+
+    connection = webapp.db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        plans = []
+        for statement, parameters in statements:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plans.append([row[3] for row in cursor.fetchall()])
+        return plans, response
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('url, index', [
+    ('/books?isbn=i1', 'ix_books_isbn_id'),
+    ('/books?author=a1', 'ix_books_author_id'),
+    ('/books?user_id=u1', 'ix_books_user_id_id'),
+    ('/books?created_after=2000-01-01', 'ix_books_book_created_id'),
+    ('/books?created_before=2100-01-01', 'ix_books_book_created_id'),
+    ('/books?created_after=2000-01-01&created_before=2100-01-01', 'ix_books_book_created_id'),
+    ('/books?sort=title', 'ix_books_title_id'),
+    ('/books?sort=-title', 'ix_books_title_id'),
+    ('/books?sort=author', 'ix_books_author_id'),
+    ('/books?sort=-book_created', 'ix_books_book_created_id'),
+])
+def test_filters_and_sorts_use_an_index(client, url, index):
+    plans, response = query_plans(client, url + '&limit=5')
+    # follow the cursor so the keyset condition is checked too
+    link = response.headers['Link']
+    next_plans, _ = query_plans(client, link[1:link.index('>')])
+
+    for plan in (plans[0], next_plans[0]):
+        assert any(index in step for step in plan), plan
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_default_sort_uses_primary_key(client):
+    plans, _ = query_plans(client, '/books?limit=5')
+    assert not any('TEMP B-TREE' in step for step in plans[0]), plans[0]
+    assert not any(step == 'SCAN books' for step in plans[0]), plans[0]
+
+
+@pytest.mark.parametrize('after', ['zz', 'W3siYSI6MX0sIngiXQ==', 'eyJhIjogMX0=', 'WzEsIDJd'])
+def test_malformed_cursor_is_rejected(client, after):
+    assert client.get('/books?sort=title&after=' + after).status_code == 400
@@ -0,0 +1,151 @@
+import base64
+
+import pytest
+
+from cache import LocalCache, DictCache, NullCache
+from metrics import BufferedStatsClient, MemorySink
+from passwords import hash_password
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def local_cache(**kwargs):
+    sink = MemorySink()
+    stats = BufferedStatsClient(sink)
+    clock = Clock()
+    return LocalCache(stats, 'test', clock=clock, **kwargs), stats, sink, clock
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, stats, sink, _ = local_cache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats.flush()
+    assert 'test_cache_eviction_count:1|c' in sink.lines
+    assert 'test_cache_size:2|g' in sink.lines
+
+
+def test_entries_expire_after_the_ttl():
+    cache, stats, sink, clock = local_cache(ttl=10)
+    cache.set('a', 1)
+    clock.now = 10
+    assert cache.get('a') == 1
+    clock.now = 11
+    assert cache.get('a') is None
+
+    stats.flush()
+    assert 'test_cache_expired_count:1|c' in sink.lines
+
+
+def test_hits_misses_and_ratio_are_reported():
+    cache, stats, sink, _ = local_cache()
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    cache.delete('a')
+    cache.get('a')
+
+    assert (cache.hits, cache.misses) == (3, 2)
+    stats.flush()
+    assert 'test_cache_hit_count:3|c' in sink.lines
+    assert 'test_cache_miss_count:2|c' in sink.lines
+    assert 'test_cache_hit_ratio:0.600000|g' in sink.lines
+
+
+def test_dict_and_null_caches():
+    cache = DictCache(BufferedStatsClient(MemorySink()), 'test')
+    cache.set('a', [1])
+    assert cache.get('a') == [1]
+    cache.delete('a')
+    assert cache.get('a') is None
+
+    cache = NullCache()
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+@pytest.fixture
+def book_app(monkeypatch):
+    import app as webapp
+
+    webapp.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    webapp.app.config['SQLALCHEMY_BINDS'] = {}
+    cache = DictCache(BufferedStatsClient(MemorySink()), 'book')
+    monkeypatch.setattr(webapp, 'book_cache', cache)
+    # keep SNS and S3 out of the test
+    monkeypatch.setattr(webapp.notifier, 'publish', lambda message: True)
+    monkeypatch.setattr(webapp.reaper, 'delete_prefix', lambda prefix: True)
+
+    with webapp.app.app_context():
+        webapp.db.create_all()
+        user = webapp.User(username='cache@example.com', password_hash=hash_password('Passw0rd!', 4),
+                           first_name='a', last_name='b')
+        webapp.db.session.add(user)
+        webapp.db.session.flush()
+        book = webapp.Book(title='t', author='a', isbn='i', published_date='2020', user_id=user.id)
+        webapp.db.session.add(book)
+        webapp.db.session.flush()
+        webapp.db.session.add(webapp.Image(file_name='a.png', file_id='f1', book_id=book.id,
+                                           s3_object_name=book.id + '/f1/a.png', user_id=user.id))
+        webapp.db.session.commit()
+        yield webapp, cache, book.id
+        webapp.db.session.remove()
+        webapp.db.drop_all()
+
+
+def auth():
+    return {'Authorization': 'Basic ' + base64.b64encode(b'cache@example.com:Passw0rd!').decode()}
+
+
+def test_book_detail_is_served_from_the_cache(book_app):
+    webapp, cache, book_id = book_app
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    client = webapp.app.test_client()
+    first = client.get('/books/' + book_id)
+    webapp.event.listen(webapp.db.engine, 'before_cursor_execute', record)
+    try:
+        second = client.get('/books/' + book_id)
+        not_modified = client.get('/books/' + book_id, headers={'If-None-Match': first.headers['ETag']})
+    finally:
+        webapp.event.remove(webapp.db.engine, 'before_cursor_execute', record)
+
+    assert first.status_code == second.status_code == 200
+    assert second.data == first.data
+    assert not_modified.status_code == 304
+    assert statements == []
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_writes_invalidate_the_cached_book(book_app):
+    webapp, cache, book_id = book_app
+    client = webapp.app.test_client()
+
+    client.get('/books/' + book_id)
+    assert book_id in cache.entries
+    assert client.delete('/books/%s/image/f1' % book_id, headers=auth()).status_code == 204
+    assert book_id not in cache.entries
+
+    client.cookie_jar.clear()
+    assert client.get('/books/' + book_id).json.get('book_images') is None
+    assert book_id in cache.entries
+    assert client.delete('/books/' + book_id, headers=auth()).status_code == 200
+    assert book_id not in cache.entries
+    assert client.get('/books/' + book_id).status_code == 404
@@ -0,0 +1,60 @@
+import random
+
+from metrics import BufferedStatsClient, MemorySink
+
+
+def client(**kwargs):
+    sink = MemorySink()
+    return BufferedStatsClient(sink, **kwargs), sink
+
+
+def test_counters_are_summed_between_flushes():
+    stats, sink = client()
+    stats.incr('a_count')
+    stats.incr('a_count', 2)
+    stats.decr('b_count')
+    stats.flush()
+
+    assert sorted(sink.lines) == ['a_count:3|c', 'b_count:-1|c']
+
+
+def test_gauges_keep_the_last_value_and_reset_before_negatives():
+    stats, sink = client()
+    stats.gauge('depth', 5)
+    stats.gauge('depth', 7)
+    stats.gauge('level', -2)
+    stats.flush()
+
+    assert sink.lines == ['depth:7|g', 'level:0|g', 'level:-2|g']
+
+
+def test_lines_are_packed_into_packets_up_to_the_size_limit():
+    stats, sink = client(max_packet_size=40)
+    for i in range(10):
+        stats.timing('t%d' % i, 1)
+    stats.flush()
+
+    assert len(sink.packets) > 1
+    assert all(len(packet) <= 40 for packet in sink.packets)
+    assert len(sink.lines) == 10
+
+
+def test_sampled_counters_are_scaled_up(monkeypatch):
+    stats, sink = client()
+    monkeypatch.setattr(random, 'random', lambda: 0.1)
+    stats.incr('hit_count', rate=0.25)
+    stats.timing('req_time', 3, rate=0.25)
+    monkeypatch.setattr(random, 'random', lambda: 0.9)
+    stats.incr('hit_count', rate=0.25)
+    stats.flush()
+
+    assert sorted(sink.lines) == ['hit_count:4|c', 'req_time:3.000000|ms|@0.25']
+
+
+def test_a_full_timer_buffer_wakes_the_flush_thread():
+    stats, sink = client(flush_interval=60, max_buffer=3)
+    for i in range(3):
+        stats.timing('t', i)
+    stats.thread.value.join(0.5)
+
+    assert len(sink.lines) == 3
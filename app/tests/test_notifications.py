@@ -0,0 +1,77 @@
+import queue
+
+from metrics import BufferedStatsClient, MemorySink
+from notifications import NotificationDispatcher
+
+
+class StubSNS:
+    """Fails the given ids on the first call, like a partial publish_batch failure."""
+
+    def __init__(self, fail_ids=()):
+        self.fail_ids = list(fail_ids)
+        self.calls = []
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.calls.append({e['Id']: e['Message'] for e in PublishBatchRequestEntries})
+        failed, self.fail_ids = self.fail_ids, []
+        return {'Failed': [{'Id': i} for i in failed]}
+
+
+def dispatcher(client, **kwargs):
+    sink = MemorySink()
+    stats = BufferedStatsClient(sink)
+    return NotificationDispatcher(lambda: client, 'arn:topic', stats, backoff=0, **kwargs), stats, sink
+
+
+def test_retries_only_failed_entries():
+    client = StubSNS(fail_ids=['1'])
+    notifier, stats, sink = dispatcher(client, workers=1, batch_wait=0.5)
+    for message in ('a', 'b', 'c'):
+        notifier.publish(message)
+    notifier.queue.join()
+    notifier.stop()
+
+    assert client.calls == [{'0': 'a', '1': 'b', '2': 'c'}, {'1': 'b'}]
+    stats.flush()
+    assert 'sns_published_count:3|c' in sink.lines
+    assert 'sns_retry_count:1|c' in sink.lines
+
+
+def test_batches_hold_at_most_ten_entries():
+    client = StubSNS()
+    notifier, _, _ = dispatcher(client, workers=1, batch_wait=0.5)
+    for i in range(25):
+        notifier.publish(str(i))
+    notifier.queue.join()
+    notifier.stop()
+
+    assert [len(call) for call in client.calls] == [10, 10, 5]
+
+
+def test_gives_up_after_max_retries():
+    class Down:
+        calls = 0
+
+        def publish_batch(self, **kwargs):
+            Down.calls += 1
+            raise IOError('SNS is down')
+
+    notifier, stats, sink = dispatcher(Down(), workers=1, max_retries=2)
+    notifier.publish('a')
+    notifier.queue.join()
+    notifier.stop()
+
+    assert Down.calls == 3
+    stats.flush()
+    assert 'sns_failed_count:1|c' in sink.lines
+
+
+def test_full_queue_drops_instead_of_blocking():
+    notifier, stats, sink = dispatcher(StubSNS())
+    # a queue with no threads draining it
+    notifier.state.value = (queue.Queue(maxsize=1), [])
+
+    assert notifier.publish('a')
+    assert not notifier.publish('b')
+    stats.flush()
+    assert 'sns_dropped_count:1|c' in sink.lines
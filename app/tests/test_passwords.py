@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from passwords import HashPool, HashPoolBusy, hash_password, check_password, hash_rounds
+
+
+def test_hash_and_check():
+    password_hash = hash_password('Passw0rd!', 4)
+    assert check_password(password_hash, 'Passw0rd!')
+    assert not check_password(password_hash, 'wrong')
+    assert not check_password('not a hash', 'Passw0rd!')
+    assert hash_rounds(password_hash) == 4
+
+
+def test_calls_past_workers_and_queue_are_turned_away():
+    pool = HashPool(4, workers=1, queue_size=0, timeout=5)
+    try:
+        pool.hash('warm up')
+        busy = threading.Thread(target=pool.run, args=(time.sleep, 1))
+        busy.start()
+        time.sleep(0.2)
+        with pytest.raises(HashPoolBusy):
+            pool.hash('Passw0rd!')
+        busy.join()
+        assert pool.check(pool.hash('Passw0rd!'), 'Passw0rd!')
+    finally:
+        pool.shutdown()
+
+
+def test_a_timed_out_job_keeps_its_slot_until_it_finishes():
+    pool = HashPool(4, workers=1, queue_size=0, timeout=0.2)
+    try:
+        pool.hash('warm up')
+        with pytest.raises(HashPoolBusy):
+            pool.run(time.sleep, 1)
+        with pytest.raises(HashPoolBusy):
+            pool.hash('Passw0rd!')
+        time.sleep(1.2)
+        assert pool.hash('Passw0rd!')
+    finally:
+        pool.shutdown()
+
+
+def test_busy_pool_returns_503(monkeypatch):
+    import app as webapp
+
+    def busy(password):
+        raise HashPoolBusy()
+
+    webapp.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    webapp.app.config['SQLALCHEMY_BINDS'] = {}
+    with webapp.app.app_context():
+        webapp.db.create_all()
+        monkeypatch.setattr(webapp.hash_pool, 'hash', busy)
+        response = webapp.app.test_client().post('/v1/user', json={
+            'username': 'busy@example.com', 'password': 'Passw0rd!',
+            'first_name': 'a', 'last_name': 'b'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def run_together(flight, key, fn, callers):
+    results = [None] * callers
+    errors = [None] * callers
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, fn)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_callers_share_one_result():
+    flight = SingleFlight(timeout=5)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.3)
+        return {'id': 1}
+
+    results, errors = run_together(flight, 'book:1', load, 5)
+    assert len(calls) == 1
+    assert errors == [None] * 5
+    assert all(result == {'id': 1} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert flight.calls == {}
+
+
+def test_concurrent_callers_share_the_exception():
+    flight = SingleFlight(timeout=5)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.3)
+        raise ValueError('database is away')
+
+    results, errors = run_together(flight, 'book:1', load, 4)
+    assert len(calls) == 1
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.calls == {}
+
+    # the failure is not remembered, the next caller runs the call again
+    assert flight.do('book:1', lambda: 'loaded') == ('loaded', False)
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight(timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    thread = threading.Thread(target=flight.do, args=('book:1', slow))
+    thread.start()
+    started.wait(5)
+    try:
+        assert flight.do('book:2', lambda: 'fast') == ('fast', False)
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_a_waiter_runs_the_call_itself_after_the_timeout():
+    flight = SingleFlight(timeout=0.1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'leader'
+
+    thread = threading.Thread(target=flight.do, args=('book:1', slow))
+    thread.start()
+    started.wait(5)
+    try:
+        assert flight.do('book:1', lambda: 'waiter') == ('waiter', False)
+    finally:
+        release.set()
+        thread.join()
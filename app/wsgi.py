@@ -0,0 +1,5 @@
+# WSGI entry point for gunicorn, see gunicorn.conf.py
+from app import app
+
+if __name__ == '__main__':
+    app.run()
@@ -8,7 +8,6 @@ ls -al
 export FLASK_APP=app.py
 # flask db init
 sudo chmod -R 777 migrations/
-flask db stamp head
-flask db migrate
+# apply the revisions in migrations/versions, stamping head would skip them
 flask db upgrade
 pwd
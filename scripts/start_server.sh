@@ -12,10 +12,30 @@ sudo /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl \
 cd /home/ubuntu/webapp/app/
 touch csye6225.log
 sudo chmod 777 csye6225.log
+# rotate by size from one place instead of in every worker
+sudo cp /home/ubuntu/webapp/scripts/logrotate.conf /etc/logrotate.d/webapp
+sudo chown root:root /etc/logrotate.d/webapp
+echo '*/10 * * * * root /usr/sbin/logrotate /etc/logrotate.d/webapp' | sudo tee /etc/cron.d/webapp-logrotate > /dev/null
 pwd
 
 export FLASK_APP=app.py
-flask db stamp head
-flask db migrate
+# apply the revisions in migrations/versions, stamping head would skip them
 flask db upgrade
-flask run -h 0.0.0.0 -p 5000 > /dev/null 2> /dev/null < /dev/null &
\ No newline at end of file
+
+# workers fork from the app preloaded in the master, so new code needs a
+# fresh master: stop any running one (it drains for up to graceful_timeout)
+# and wait for it to remove its pidfile before starting
+PIDFILE=/tmp/webapp-gunicorn.pid
+if [ -f $PIDFILE ]; then
+    kill -TERM $(cat $PIDFILE) 2> /dev/null
+    for i in $(seq 1 40); do
+        [ -f $PIDFILE ] && kill -0 $(cat $PIDFILE) 2> /dev/null || break
+        sleep 1
+    done
+    if [ -f $PIDFILE ] && kill -0 $(cat $PIDFILE) 2> /dev/null; then
+        kill -KILL $(cat $PIDFILE)
+    fi
+    rm -f $PIDFILE
+fi
+
+gunicorn --config gunicorn.conf.py wsgi:app > /dev/null 2> /dev/null < /dev/null &